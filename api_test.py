@@ -11,6 +11,17 @@ def j(resp):
     except Exception:
         return {"raw": resp.text}
 
+# ----------------------------
+# 0) Health checks
+# ----------------------------
+r = requests.get(f"{BASE_URL}/health/live")
+print("GET /health/live:", r.status_code, j(r))
+assert r.status_code == 200
+
+r = requests.get(f"{BASE_URL}/health/ready")
+print("GET /health/ready:", r.status_code, j(r))
+assert r.status_code == 200
+
 # ----------------------------
 # 1) Crear TIPO DE RECURSO
 # ----------------------------
@@ -52,7 +63,7 @@ recurso_data = {
     "titulo": "Cálculo I",
     "autor": "Larson",
     "descripcion": "Libro de cálculo",    
-    "isban": 9431798498175,
+    "isbn": "978-0-306-40615-7",
     "copias_totales": 2,
     "copias_disponibles": 2,    # opcional; si no viene = totales
     "is_promoted": False,
@@ -60,8 +71,35 @@ recurso_data = {
 }
 r = requests.post(f"{BASE_URL}/recursos", json=recurso_data)
 print("POST /recursos:", r.status_code, j(r))
-assert r.status_code in (200, 201), "No se pudo crear el recurso"
-recurso_id = j(r).get("id")
+if r.status_code in (200, 201):
+    recurso_id = j(r).get("id")
+elif r.status_code == 409:
+    # ISBN ya registrado -> lo buscamos entre los duplicados
+    r2 = requests.get(f"{BASE_URL}/recursos/duplicados", params={"isbn": recurso_data["isbn"]})
+    assert r2.status_code == 200 and j(r2), "No se pudo recuperar el recurso existente"
+    recurso_id = j(r2)[0]["id"]
+else:
+    raise AssertionError("No se pudo crear el recurso")
+
+# Mismo libro con su ISBN-10 -> 409 por el índice único del ISBN normalizado
+r = requests.post(f"{BASE_URL}/recursos", json={**recurso_data, "isbn": "0-306-40615-2"})
+print("POST /recursos (ISBN-10 duplicado):", r.status_code, j(r))
+assert r.status_code == 409
+
+# ISBN con dígito de control incorrecto -> 422
+r = requests.post(f"{BASE_URL}/recursos", json={**recurso_data, "isbn": "9780306406158"})
+print("POST /recursos (ISBN no válido):", r.status_code)
+assert r.status_code == 422
+
+# Candidatos a duplicado por titulo+autor normalizados
+r = requests.get(f"{BASE_URL}/recursos/duplicados", params={"titulo": "calculo i", "autor": "LARSON"})
+print("GET /recursos/duplicados:", r.status_code, [x["id"] for x in j(r)])
+assert r.status_code == 200 and recurso_id in [x["id"] for x in j(r)]
+
+# autor sin titulo no identifica candidatos -> 400
+r = requests.get(f"{BASE_URL}/recursos/duplicados", params={"autor": "larson"})
+print("GET /recursos/duplicados?autor=:", r.status_code)
+assert r.status_code == 400
 
 # Listar recursos
 r = requests.get(f"{BASE_URL}/recursos")
@@ -73,6 +111,20 @@ r = requests.get(f"{BASE_URL}/recursos/{recurso_id}")
 print(f"GET /recursos/{recurso_id}:", r.status_code, j(r))
 assert r.status_code == 200
 
+# Selección de campos (?fields=)
+r = requests.get(f"{BASE_URL}/recursos", params={"fields": "id,titulo,autor,copias_disponibles"})
+print("GET /recursos?fields=...:", r.status_code, j(r)[:1])
+assert r.status_code == 200
+assert all(set(x) == {"id", "titulo", "autor", "copias_disponibles"} for x in j(r))
+
+r = requests.get(f"{BASE_URL}/recursos/{recurso_id}", params={"fields": "titulo"})
+print(f"GET /recursos/{recurso_id}?fields=titulo:", r.status_code, j(r))
+assert r.status_code == 200 and j(r) == {"titulo": recurso_data["titulo"]}
+
+r = requests.get(f"{BASE_URL}/recursos", params={"fields": "id,no_existe"})
+print("GET /recursos?fields=id,no_existe:", r.status_code, j(r))
+assert r.status_code == 400
+
 # Actualizar recurso (p.ej., marcar como promovido)
 r = requests.put(f"{BASE_URL}/recursos/{recurso_id}", json={"is_promoted": True})
 print(f"PUT /recursos/{recurso_id}:", r.status_code, j(r))
@@ -87,11 +139,22 @@ prestamo_data = {
     "usuario": "ana@example.com",
     "fecha_vencimiento": venc
 }
+# Suscripción SSE a los cambios de disponibilidad del recurso antes de prestarlo
+stream = requests.get(f"{BASE_URL}/recursos/stream", params={"ids": recurso_id}, stream=True, timeout=10)
+assert stream.status_code == 200
+stream_lines = stream.iter_lines(decode_unicode=True)
+assert next(stream_lines).startswith(":")  # comentario inicial: ya suscrito
+
 r = requests.post(f"{BASE_URL}/prestamos", json=prestamo_data)
 print("POST /prestamos:", r.status_code, j(r))
 assert r.status_code in (200, 201), "No se pudo crear el préstamo"
 prestamo_id = j(r).get("id")
 
+evento = next(line for line in stream_lines if line.startswith("data:"))
+print("SSE /recursos/stream:", evento)
+assert f'"recurso_id": {recurso_id}' in evento and '"copias_disponibles": 1' in evento
+stream.close()
+
 # Listar préstamos activos
 r = requests.get(f"{BASE_URL}/prestamos", params={"solo_activos": True})
 print("GET /prestamos?solo_activos=true:", r.status_code, len(j(r)))
@@ -111,7 +174,53 @@ assert r.status_code == 200
 
 r2 = requests.get(f"{BASE_URL}/prestamos/{prestamo_id}")
 print("POST-DEVOLUCIÓN:", r2.status_code, r2.json())
+assert r2.status_code == 200 and r2.json()["fecha_devolucion"] is not None
+
+# ----------------------------
+# 4) ARCHIVO de préstamos devueltos
+# ----------------------------
+# Un segundo préstamo devuelto: será el id más alto y nunca se archiva
+r = requests.post(f"{BASE_URL}/prestamos", json=prestamo_data)
+assert r.status_code in (200, 201), "No se pudo crear el segundo préstamo"
+prestamo_id_2 = j(r).get("id")
+r = requests.put(f"{BASE_URL}/prestamos/{prestamo_id_2}/devolucion")
+assert r.status_code == 200
+
+# Ejecuta el job sobre la misma BD que el servidor (./library.db): con --dias 0
+# se archivan todos los préstamos devueltos salvo el del id más alto
+import archivar
+archivados = archivar.run(["--dias", "0"])
+assert archivados >= 1
+
+r = requests.get(f"{BASE_URL}/prestamos")
+ids_activos = [p["id"] for p in j(r)]
+print("GET /prestamos tras archivar:", r.status_code, ids_activos)
+assert prestamo_id not in ids_activos and prestamo_id_2 in ids_activos
+
+r = requests.get(f"{BASE_URL}/prestamos", params={"incluir_historico": True})
+ids_todos = [p["id"] for p in j(r)]
+print("GET /prestamos?incluir_historico=true:", r.status_code, ids_todos)
+assert prestamo_id in ids_todos and prestamo_id_2 in ids_todos
+
+r = requests.get(f"{BASE_URL}/prestamos/{prestamo_id}")
+print(f"GET /prestamos/{prestamo_id} (archivado):", r.status_code)
+assert r.status_code == 404
+
+r = requests.get(f"{BASE_URL}/prestamos/{prestamo_id}", params={"incluir_historico": True})
+print(f"GET /prestamos/{prestamo_id}?incluir_historico=true:", r.status_code, j(r))
+assert r.status_code == 200 and j(r)["devuelto"] is True
+
+
 
+# Rate limit: un cliente que repite listados acaba recibiendo 429, aunque
+# envíe una X-API-Key distinta (no configurada en API_KEYS) en cada petición
+for i in range(100):
+    headers = {"X-API-Key": f"api-test-{datetime.now(timezone.utc).timestamp()}-{i}"}
+    r = requests.get(f"{BASE_URL}/recursos", params={"fields": "id"}, headers=headers)
+    if r.status_code == 429:
+        break
+print("GET /recursos en bucle:", r.status_code, r.headers.get("Retry-After"))
+assert r.status_code == 429 and int(r.headers["Retry-After"]) >= 1
 
 
 print("\n Todas las pruebas pasaron correctamente")
@@ -0,0 +1,36 @@
+# archivar.py
+# Mueve a prestamos_historico los préstamos devueltos hace más días que el horizonte.
+# Pensado para ejecutarse periódicamente (cron, systemd timer...):
+#
+#   python archivar.py --dias 365 --lote 500
+import argparse
+import logging
+import os
+
+import crud
+from bbdd import SessionLocal, init_db
+
+logger = logging.getLogger("biblioteca_digital")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Archiva préstamos devueltos antiguos")
+    parser.add_argument("--dias", type=int, default=int(os.getenv("ARCHIVO_DIAS", "365")),
+                        help="días desde la devolución para archivar; por defecto ARCHIVO_DIAS o 365")
+    parser.add_argument("--lote", type=int, default=500,
+                        help="préstamos movidos por transacción")
+    return parser.parse_args(argv)
+
+
+def run(argv=None) -> int:
+    args = parse_args(argv)
+    init_db()
+    with SessionLocal() as db:
+        total = crud.archivar_prestamos(db, dias=args.dias, lote=args.lote)
+    print(f"Préstamos archivados: {total}")
+    return total
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="[%(asctime)s] %(levelname)s - %(message)s")
+    run()
@@ -1,10 +1,21 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import logging
+import os
 
-from models import DecBase
+from sqlalchemy import create_engine, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from models import DecBase, Recurso
+from normalizacion import huella_titulo_autor, normalizar_isbn
+
+logger = logging.getLogger("biblioteca_digital")
 
 DATABASE_URL = "sqlite:///./library.db"
 
+# Versión del esquema guardada en la propia BD (PRAGMA user_version).
+# Súbela cada vez que cambien tablas/columnas/índices en models.py.
+SCHEMA_VERSION = 4
+
 engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False}
@@ -13,6 +24,95 @@ engine = create_engine(
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 
+def _reset_engine_after_fork() -> None:
+    # Tras un fork el hijo hereda el pool del padre: se descarta sin cerrar
+    # esas conexiones (siguen siendo del padre) y el hijo abre las suyas.
+    engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_engine_after_fork)
+
+
+def get_schema_version(bind: Engine = engine) -> int:
+    with bind.connect() as conn:
+        return conn.execute(text("PRAGMA user_version")).scalar() or 0
+
+
+def _agregar_columnas(bind: Engine) -> list[str]:
+    """
+    create_all no modifica tablas existentes: añade las columnas nuevas de
+    models.py que falten (solo columnas nullable, sin reescribir la tabla).
+    """
+    agregadas = []
+    insp = inspect(bind)
+    with bind.begin() as conn:
+        for table in DecBase.metadata.sorted_tables:
+            existentes = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existentes:
+                    continue
+                tipo = col.type.compile(dialect=bind.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {tipo}"))
+                agregadas.append(f"{table.name}.{col.name}")
+    return agregadas
+
+
+def _rellenar_normalizados(bind: Engine) -> None:
+    # v2: isbn_normalizado y huella_titulo_autor para recursos ya existentes
+    with Session(bind) as db:
+        vistos = set(db.execute(
+            select(Recurso.isbn_normalizado).where(Recurso.isbn_normalizado.is_not(None))
+        ).scalars())
+        pendientes = db.execute(
+            select(Recurso).where(Recurso.huella_titulo_autor.is_(None)).order_by(Recurso.id)
+        ).scalars()
+        for rec in pendientes:
+            rec.huella_titulo_autor = huella_titulo_autor(rec.titulo, rec.autor)
+            if rec.isbn and rec.isbn_normalizado is None:
+                try:
+                    norm = normalizar_isbn(rec.isbn)
+                except ValueError:
+                    logger.warning(f"[bbdd] Recurso {rec.id}: ISBN no válido '{rec.isbn}', no se normaliza")
+                    continue
+                if norm in vistos:
+                    # El índice único no admite el duplicado: se deja para revisión manual
+                    logger.warning(f"[bbdd] Recurso {rec.id}: ISBN {norm} duplicado, no se normaliza")
+                    continue
+                vistos.add(norm)
+                rec.isbn_normalizado = norm
+        db.commit()
+
+
+def _migrar(bind: Engine) -> None:
+    agregadas = _agregar_columnas(bind)
+    if agregadas:
+        logger.info(f"[bbdd] Columnas agregadas: {', '.join(agregadas)}")
+    _rellenar_normalizados(bind)
+    # Índices de tablas que ya existían (create_all solo los crea con la tabla)
+    for table in DecBase.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind, checkfirst=True)
+
+
+def init_db(bind: Engine = engine, force: bool = False) -> bool:
+    """
+    Crea las tablas y migra las existentes solo si la versión guardada no
+    coincide con SCHEMA_VERSION (o si force=True). Devuelve True si se ejecutó.
+    Con la versión al día basta un PRAGMA: no se inspecciona el esquema.
+    """
+    if not force and get_schema_version(bind) == SCHEMA_VERSION:
+        logger.debug(f"[bbdd] Esquema v{SCHEMA_VERSION} al día, se omite create_all")
+        return False
+    DecBase.metadata.create_all(bind=bind)
+    _migrar(bind)
+    with bind.begin() as conn:
+        # PRAGMA no admite parámetros; SCHEMA_VERSION es un int nuestro
+        conn.execute(text(f"PRAGMA user_version = {int(SCHEMA_VERSION)}"))
+    logger.info(f"[bbdd] Esquema creado/actualizado a v{SCHEMA_VERSION}")
+    return True
+
+
 if __name__ == "__main__":
-    DecBase.metadata.create_all(bind=engine)
-    print("Base de datos y tablas creadas correctamente.")
\ No newline at end of file
+    init_db(force=True)
+    print("Base de datos y tablas creadas correctamente.")
@@ -0,0 +1,62 @@
+# bench_startup.py
+# Mide el tiempo de import de main.py y el del evento de arranque (startup)
+# en intérpretes nuevos, como le ocurre a cada worker de uvicorn al reiniciar.
+#
+# Uso: python bench_startup.py [repeticiones]
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent
+
+# Se ejecuta en un proceso hijo: imprime "import_ms boot_ms"
+CHILD = """
+import asyncio, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+asyncio.run(main.app.router.startup())
+t2 = time.perf_counter()
+print(f"{(t1 - t0) * 1000:.2f} {(t2 - t1) * 1000:.2f}")
+"""
+
+
+def run_once(workdir: Path, mode: str) -> tuple[float, float]:
+    env = dict(os.environ, DB_INIT_MODE=mode, PYTHONPATH=str(REPO))
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True,
+    ).stdout.strip().splitlines()[-1]
+    imp, boot = out.split()
+    return float(imp), float(boot)
+
+
+def bench(label: str, mode: str, repeticiones: int, fresh_db: bool) -> None:
+    imports, boots = [], []
+    workdir = Path(tempfile.mkdtemp(prefix="bench_startup_"))
+    try:
+        run_once(workdir, "always")  # calienta .pyc y deja la BD creada
+        for _ in range(repeticiones):
+            if fresh_db:
+                (workdir / "library.db").unlink(missing_ok=True)
+            imp, boot = run_once(workdir, mode)
+            imports.append(imp)
+            boots.append(boot)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(
+        f"{label:<34} import {statistics.median(imports):8.2f} ms   "
+        f"startup {statistics.median(boots):8.2f} ms   (mediana de {repeticiones})"
+    )
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    bench("BD nueva (create_all)", "auto", n, fresh_db=True)
+    bench("DB_INIT_MODE=always", "always", n, fresh_db=False)
+    bench("DB_INIT_MODE=auto (versión al día)", "auto", n, fresh_db=False)
+    bench("DB_INIT_MODE=skip", "skip", n, fresh_db=False)
@@ -1,21 +1,30 @@
 from __future__ import annotations
 
 import logging
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 from sqlalchemy.exc import IntegrityError
 
-from sqlalchemy import select, func
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func, or_, insert, delete, literal
+from sqlalchemy.orm import Session, load_only
 from sqlalchemy import inspect
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 import logging
+import eventos
 import models   
 import schemas  
+from normalizacion import huella_titulo_autor, normalizar_isbn
 
 logger = logging.getLogger("biblioteca_digital")
 
 
+def _load_only(model, fields: Optional[list[str]]) -> list:
+    """Opciones de carga diferida: solo lee de disco las columnas pedidas (fields=None -> todas)."""
+    if not fields:
+        return []
+    return [load_only(*(getattr(model, f) for f in fields))]
+
+
 # =====================================
 # ============ TIPO RECURSO ===========
 # =====================================
@@ -33,20 +42,22 @@ def create_tipo_recurso(db: Session, data: schemas.TipoRecursoCreate) -> models.
         return None
 
 
-def list_tipos_recurso(db: Session) -> list[models.TipoRecurso]:
+def list_tipos_recurso(db: Session, fields: Optional[list[str]] = None) -> list[models.TipoRecurso]:
     logger.debug("[crud] Listando tipos de recurso")
     rows = db.execute(
-        select(models.TipoRecurso).order_by(models.TipoRecurso.id.desc())
+        select(models.TipoRecurso)
+        .options(*_load_only(models.TipoRecurso, fields))
+        .order_by(models.TipoRecurso.id.desc())
     ).scalars().all()
     logger.info(f"[crud] Se encontraron {len(rows)} tipos de recurso")
     return rows
 
 
-def get_tipo_recurso(db: Session, tipo_id: int) -> Optional[models.TipoRecurso]:
+def get_tipo_recurso(db: Session, tipo_id: int, fields: Optional[list[str]] = None) -> Optional[models.TipoRecurso]:
     logger.debug(f"[crud] Buscando tipo recurso id={tipo_id}")
-    tr = db.get(models.TipoRecurso, tipo_id)
+    tr = db.get(models.TipoRecurso, tipo_id, options=_load_only(models.TipoRecurso, fields))
     if tr:
-        logger.info(f"[crud] Tipo recurso encontrado: {tr.id} - {tr.nombre}")
+        logger.info(f"[crud] Tipo recurso encontrado: {tr.id}")
     else:
         logger.warning(f"[crud] Tipo recurso no encontrado: {tipo_id}")
     return tr
@@ -71,7 +82,12 @@ def update_tipo_recurso(db: Session, tipo_id: int, patch: schemas.TipoRecursoUpd
 # =============== RECURSO =============
 # =====================================
 
-def create_recurso(db: Session, data: schemas.RecursoCreate) -> models.Recurso:
+def _es_conflicto_isbn(e: IntegrityError) -> bool:
+    # SQLite: "UNIQUE constraint failed: recursos.isbn_normalizado"
+    return "isbn_normalizado" in str(e.orig)
+
+
+def create_recurso(db: Session, data: schemas.RecursoCreate) -> models.Recurso | None:
     logger.debug(f"[crud] Creando recurso: {data}")
 
     # Si no llega copias_disponibles, iguala a copias_totales (tu schema ya lo permite)
@@ -89,9 +105,21 @@ def create_recurso(db: Session, data: schemas.RecursoCreate) -> models.Recurso:
     data_for_model = {k: v for k, v in payload.items() if k in allowed}
 
     rec = models.Recurso(**data_for_model)
+    # Columnas derivadas para el índice único de ISBN y la búsqueda de duplicados
+    isbn_norm = normalizar_isbn(rec.isbn) if rec.isbn else None
+    rec.isbn_normalizado = isbn_norm
+    rec.huella_titulo_autor = huella_titulo_autor(rec.titulo, rec.autor)
 
     db.add(rec)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if not _es_conflicto_isbn(e):
+            raise
+        # ISBN ya registrado -> None para que el endpoint responda 409
+        logger.warning(f"[crud] Recurso duplicado: ISBN {isbn_norm} ya existe")
+        return None
     db.refresh(rec)
     logger.info(f"[crud] Recurso creado: {rec.id} - {rec.titulo}")
     return rec
@@ -101,10 +129,11 @@ def list_recursos(
     db: Session,
     q: Optional[str] = None,
     tipo_id: Optional[int] = None,
-    solo_promocionados: bool = False
+    solo_promocionados: bool = False,
+    fields: Optional[list[str]] = None,
 ) -> list[models.Recurso]:
     logger.debug("[crud] Listando recursos")
-    stmt = select(models.Recurso)
+    stmt = select(models.Recurso).options(*_load_only(models.Recurso, fields))
     if q:
         like = f"%{q.lower()}%"
         stmt = stmt.where(
@@ -121,11 +150,11 @@ def list_recursos(
     return rows
 
 
-def get_recurso(db: Session, recurso_id: int) -> Optional[models.Recurso]:
+def get_recurso(db: Session, recurso_id: int, fields: Optional[list[str]] = None) -> Optional[models.Recurso]:
     logger.debug(f"[crud] Buscando recurso id={recurso_id}")
-    rec = db.get(models.Recurso, recurso_id)
+    rec = db.get(models.Recurso, recurso_id, options=_load_only(models.Recurso, fields))
     if rec:
-        logger.info(f"[crud] Recurso encontrado: {rec.id} - {rec.titulo}")
+        logger.info(f"[crud] Recurso encontrado: {rec.id}")
     else:
         logger.warning(f"[crud] Recurso no encontrado: {recurso_id}")
     return rec
@@ -161,15 +190,78 @@ def update_recurso(db: Session, recurso_id: int, patch: schemas.RecursoUpdate) -
             )
             return None
 
+    # Solo se renormaliza el ISBN si viene en el patch: los recursos antiguos con
+    # ISBN no válido o duplicado (sin normalizar en la migración) se dejan como están
+    isbn_norm = None
+    if "isbn" in data:
+        try:
+            isbn_norm = normalizar_isbn(data["isbn"]) if data["isbn"] else None
+        except ValueError as e:
+            logger.warning(f"[crud] Denegado: ISBN no válido '{data['isbn']}': {e}")
+            return None
+
     for field, value in data.items():
         setattr(rec, field, value)
+    if "isbn" in data:
+        rec.isbn_normalizado = isbn_norm
+    if "titulo" in data or "autor" in data:
+        rec.huella_titulo_autor = huella_titulo_autor(rec.titulo, rec.autor)
 
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        if _es_conflicto_isbn(e):
+            logger.warning(f"[crud] Denegado: ISBN {isbn_norm} ya pertenece a otro recurso")
+        else:
+            logger.warning(f"[crud] Denegado: restricción de integridad al actualizar {recurso_id}: {e.orig}")
+        return None
     db.refresh(rec)
     logger.info(f"[crud] Recurso actualizado: {rec.id} - {rec.titulo}")
+    if "copias_totales" in data or "copias_disponibles" in data:
+        eventos.publicar_disponibilidad(rec)
     return rec
 
 
+def buscar_duplicados(
+    db: Session,
+    isbn: Optional[str] = None,
+    titulo: Optional[str] = None,
+    autor: Optional[str] = None,
+) -> list[models.Recurso]:
+    """Candidatos a duplicado de un ISBN y/o titulo+autor (búsqueda por índice)."""
+    logger.debug(f"[crud] Buscando duplicados isbn={isbn} titulo={titulo} autor={autor}")
+    conds = []
+    if isbn:
+        conds.append(models.Recurso.isbn_normalizado == normalizar_isbn(isbn))
+    if titulo:
+        conds.append(models.Recurso.huella_titulo_autor == huella_titulo_autor(titulo, autor))
+    if not conds:
+        return []
+    stmt = select(models.Recurso).where(or_(*conds)).order_by(models.Recurso.id)
+    rows = db.execute(stmt).scalars().all()
+    logger.info(f"[crud] Se encontraron {len(rows)} candidatos a duplicado")
+    return rows
+
+
+def grupos_duplicados(db: Session) -> list[list[int]]:
+    """Grupos de ids con la misma huella titulo+autor (GROUP BY sobre el índice, sin comparar por pares)."""
+    logger.debug("[crud] Agrupando recursos duplicados")
+    huellas = select(models.Recurso.huella_titulo_autor).where(
+        models.Recurso.huella_titulo_autor.is_not(None)
+    ).group_by(models.Recurso.huella_titulo_autor).having(func.count() > 1)
+    rows = db.execute(
+        select(models.Recurso.huella_titulo_autor, models.Recurso.id)
+        .where(models.Recurso.huella_titulo_autor.in_(huellas))
+        .order_by(models.Recurso.huella_titulo_autor, models.Recurso.id)
+    ).all()
+    grupos: dict[str, list[int]] = {}
+    for huella, recurso_id in rows:
+        grupos.setdefault(huella, []).append(recurso_id)
+    logger.info(f"[crud] Se encontraron {len(grupos)} grupos de duplicados")
+    return list(grupos.values())
+
+
 # =====================================
 # ============== PRÉSTAMO =============
 # =====================================
@@ -201,28 +293,45 @@ def create_prestamo(db: Session, data: schemas.PrestamoCreate) -> Optional[model
     db.commit()
     db.refresh(p)
     logger.info(f"[crud] Préstamo creado: {p.id} (recurso {p.recurso_id})")
+    eventos.publicar_disponibilidad(rec)
     return p
 
 
 def list_prestamos(
     db: Session,
     usuario: Optional[str] = None,
-    solo_activos: bool = False
-) -> list[models.Prestamo]:
+    solo_activos: bool = False,
+    fields: Optional[list[str]] = None,
+    incluir_historico: bool = False,
+) -> list[models.Prestamo | models.PrestamoHistorico]:
     logger.debug("[crud] Listando préstamos")
-    stmt = select(models.Prestamo)
+    stmt = select(models.Prestamo).options(*_load_only(models.Prestamo, fields))
     if usuario:
         stmt = stmt.where(models.Prestamo.usuario == usuario)
     if solo_activos:
         stmt = stmt.where(models.Prestamo.devuelto.is_(False))
     rows = db.execute(stmt.order_by(models.Prestamo.id.desc())).scalars().all()
+    # El histórico solo tiene préstamos devueltos: no aporta nada a solo_activos
+    if incluir_historico and not solo_activos:
+        stmt = select(models.PrestamoHistorico).options(*_load_only(models.PrestamoHistorico, fields))
+        if usuario:
+            stmt = stmt.where(models.PrestamoHistorico.usuario == usuario)
+        hist = db.execute(stmt).scalars().all()
+        rows = sorted([*rows, *hist], key=lambda p: p.id, reverse=True)
     logger.info(f"[crud] Se encontraron {len(rows)} préstamos")
     return rows
 
 
-def get_prestamo(db: Session, prestamo_id: int) -> Optional[models.Prestamo]:
+def get_prestamo(
+    db: Session,
+    prestamo_id: int,
+    fields: Optional[list[str]] = None,
+    incluir_historico: bool = False,
+) -> Optional[models.Prestamo | models.PrestamoHistorico]:
     logger.debug(f"[crud] Buscando préstamo id={prestamo_id}")
-    p = db.get(models.Prestamo, prestamo_id)
+    p = db.get(models.Prestamo, prestamo_id, options=_load_only(models.Prestamo, fields))
+    if not p and incluir_historico:
+        p = db.get(models.PrestamoHistorico, prestamo_id, options=_load_only(models.PrestamoHistorico, fields))
     if p:
         logger.info(f"[crud] Préstamo encontrado: {p.id}")
     else:
@@ -238,12 +347,15 @@ def devolver_prestamo(db: Session, prestamo_id: int) -> Optional[models.Prestamo
         return None
     if not p.devuelto:
         p.devuelto = True
+        p.fecha_devolucion = datetime.now(timezone.utc)
         rec = db.get(models.Recurso, p.recurso_id)
         if rec:
             rec.copias_disponibles += 1
         db.commit()
         db.refresh(p)
         logger.info(f"[crud] Préstamo devuelto: {p.id}")
+        if rec:
+            eventos.publicar_disponibilidad(rec)
     else:
         logger.info(f"[crud] Préstamo ya estaba devuelto: {p.id}")
     return p
@@ -259,8 +371,64 @@ def update_prestamo(db: Session, prestamo_id: int, patch: schemas.PrestamoUpdate
     data = patch.model_dump(exclude_unset=True)
     for field, value in data.items():
         setattr(p, field, value)
+    if "devuelto" in data:
+        if not p.devuelto:
+            p.fecha_devolucion = None
+        elif p.fecha_devolucion is None:
+            p.fecha_devolucion = datetime.now(timezone.utc)
 
     db.commit()
     db.refresh(p)
     logger.info(f"[crud] Préstamo actualizado: {p.id}")
     return p
+
+
+def archivar_prestamos(db: Session, dias: int, lote: int = 500) -> int:
+    """
+    Mueve a prestamos_historico los préstamos devueltos hace más de `dias` días
+    (por fecha_devolucion; los antiguos sin ella, por fecha_prestamo), en lotes
+    de `lote` filas (un commit por lote para no bloquear la BD). Devuelve
+    cuántos se han archivado.
+    """
+    ahora = datetime.now(timezone.utc)
+    limite = ahora - timedelta(days=dias)
+    logger.debug(f"[crud] Archivando préstamos devueltos anteriores a {limite} (lotes de {lote})")
+
+    # Nunca se archiva el id más alto: SQLite reutilizaría ids ya archivados
+    max_id = db.execute(select(func.max(models.Prestamo.id))).scalar()
+    columnas = [c.name for c in models.PrestamoHistorico.__table__.columns if c.name != "archivado_en"]
+    total = 0
+    while True:
+        ids = db.execute(
+            select(models.Prestamo.id)
+            .where(
+                models.Prestamo.devuelto.is_(True),
+                or_(
+                    models.Prestamo.fecha_devolucion < limite,
+                    models.Prestamo.fecha_devolucion.is_(None) & (models.Prestamo.fecha_prestamo < limite),
+                ),
+                models.Prestamo.id != max_id,
+            )
+            .order_by(models.Prestamo.id)
+            .limit(lote)
+        ).scalars().all()
+        if not ids:
+            break
+        db.execute(
+            insert(models.PrestamoHistorico).from_select(
+                [*columnas, "archivado_en"],
+                select(
+                    *(getattr(models.Prestamo, c) for c in columnas),
+                    literal(ahora, models.PrestamoHistorico.archivado_en.type),
+                ).where(models.Prestamo.id.in_(ids)),
+            )
+        )
+        db.execute(
+            delete(models.Prestamo).where(models.Prestamo.id.in_(ids)),
+            execution_options={"synchronize_session": False},
+        )
+        db.commit()
+        total += len(ids)
+        logger.debug(f"[crud] Lote archivado: {len(ids)} préstamos (total {total})")
+    logger.info(f"[crud] Préstamos archivados: {total}")
+    return total
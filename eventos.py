@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from typing import Optional
+
+logger = logging.getLogger("biblioteca_digital")
+
+# Tamaño máximo de la cola de cada suscriptor. Si un cliente no consume a tiempo
+# y se llena, se le cierra el stream (evento "overflow") y debe reconectar.
+MAX_COLA_SUSCRIPTOR = 100
+
+# Marca interna para avisar al stream de que se ha desbordado
+OVERFLOW = object()
+
+
+class Suscripcion:
+    def __init__(self, loop: asyncio.AbstractEventLoop, recurso_ids: Optional[set[int]], maxsize: int):
+        self.loop = loop
+        self.recurso_ids = recurso_ids  # None -> todos los recursos
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.desbordada = False
+
+    def interesa(self, evento: dict) -> bool:
+        return self.recurso_ids is None or evento["recurso_id"] in self.recurso_ids
+
+    def _ofrecer(self, evento: dict) -> None:
+        # Se ejecuta en el event loop del suscriptor
+        if self.desbordada:
+            return
+        try:
+            self.cola.put_nowait(evento)
+        except asyncio.QueueFull:
+            # Backpressure: se vacía la cola y se deja solo la marca de desbordamiento
+            self.desbordada = True
+            while not self.cola.empty():
+                self.cola.get_nowait()
+            self.cola.put_nowait(OVERFLOW)
+
+
+class Broker:
+    """
+    Pub/sub en memoria del proceso (cada worker tiene el suyo).
+    publicar() se puede llamar desde cualquier hilo (los endpoints sync corren
+    en el threadpool); la entrega se hace en el event loop de cada suscriptor.
+    """
+
+    def __init__(self, maxsize: int = MAX_COLA_SUSCRIPTOR):
+        self.maxsize = maxsize
+        self._suscripciones: set[Suscripcion] = set()
+        self._lock = threading.Lock()
+
+    def suscribir(self, recurso_ids: Optional[set[int]] = None) -> Suscripcion:
+        # Debe llamarse desde una corrutina (usa el loop en ejecución)
+        sub = Suscripcion(asyncio.get_running_loop(), recurso_ids, self.maxsize)
+        with self._lock:
+            self._suscripciones.add(sub)
+        logger.debug(f"[eventos] Nueva suscripción ids={recurso_ids} (total {len(self._suscripciones)})")
+        return sub
+
+    def cancelar(self, sub: Suscripcion) -> None:
+        with self._lock:
+            self._suscripciones.discard(sub)
+        logger.debug(f"[eventos] Suscripción cancelada (total {len(self._suscripciones)})")
+
+    def hay_suscripciones(self) -> bool:
+        return bool(self._suscripciones)
+
+    def publicar(self, evento: dict) -> None:
+        with self._lock:
+            destinos = [s for s in self._suscripciones if s.interesa(evento)]
+        for sub in destinos:
+            try:
+                sub.loop.call_soon_threadsafe(sub._ofrecer, evento)
+            except RuntimeError:
+                # Loop cerrado (worker parando): se descarta la suscripción
+                self.cancelar(sub)
+
+
+broker = Broker()
+
+
+def publicar_disponibilidad(rec) -> None:
+    """Emite el estado de copias de un recurso. Llamar después del commit."""
+    # Sin suscriptores no se leen las copias: tras el commit eso recargaría el recurso
+    if not broker.hay_suscripciones():
+        return
+    broker.publicar({
+        "recurso_id": rec.id,
+        "copias_disponibles": rec.copias_disponibles,
+        "copias_totales": rec.copias_totales,
+    })
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Protocol
+
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger("biblioteca_digital")
+
+
+@dataclass(frozen=True)
+class Limite:
+    """Token bucket: `capacidad` peticiones de ráfaga, recargando `por_segundo` tokens por segundo."""
+    capacidad: float
+    por_segundo: float
+
+    def __post_init__(self):
+        # capacidad < 1 no admitiría ninguna petición; por_segundo = 0 no recargaría nunca
+        if self.capacidad < 1:
+            raise ValueError(f"capacidad debe ser >= 1 (recibido {self.capacidad})")
+        if self.por_segundo <= 0:
+            raise ValueError(f"por_segundo debe ser > 0 (recibido {self.por_segundo})")
+
+    @classmethod
+    def parse(cls, valor: str, nombre: str = "límite") -> "Limite":
+        # "capacidad/por_segundo", p.ej. "60/20"; `nombre` (p.ej. la variable de entorno) para el error
+        try:
+            capacidad, por_segundo = valor.split("/")
+            return cls(float(capacidad), float(por_segundo))
+        except ValueError as e:
+            raise ValueError(
+                f"{nombre}={valor!r} no válido: se espera 'capacidad/por_segundo' "
+                f"con capacidad >= 1 y por_segundo > 0, p.ej. '20/5' ({e})"
+            ) from None
+
+
+class BucketStore(Protocol):
+    """
+    Almacén de buckets. consumir() devuelve 0 si hay token (y lo gasta) o los
+    segundos a esperar hasta el siguiente. Implementa este método sobre un
+    almacén compartido (Redis, memcached...) para limitar entre workers/hosts.
+    """
+
+    def consumir(self, clave: str, limite: Limite) -> float: ...
+
+
+class MemoriaBucketStore:
+    """Buckets en memoria del proceso (cada worker limita por su cuenta)."""
+
+    def __init__(self, max_claves: int = 10_000):
+        self.max_claves = max_claves
+        self._buckets: dict[str, tuple[float, float]] = {}  # clave -> (tokens, instante)
+        self._lock = threading.Lock()
+
+    def consumir(self, clave: str, limite: Limite) -> float:
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, antes = self._buckets.get(clave, (limite.capacidad, ahora))
+            tokens = min(limite.capacidad, tokens + (ahora - antes) * limite.por_segundo)
+            if tokens >= 1:
+                self._guardar(clave, tokens - 1, ahora)
+                return 0.0
+            self._guardar(clave, tokens, ahora)
+            return (1 - tokens) / limite.por_segundo
+
+    def _guardar(self, clave: str, tokens: float, ahora: float) -> None:
+        # Reinsertar mantiene el dict ordenado del menos al más recientemente usado
+        if self._buckets.pop(clave, None) is None and len(self._buckets) >= self.max_claves:
+            # Sin sitio: se descarta el bucket usado hace más tiempo
+            self._buckets.pop(next(iter(self._buckets)))
+        self._buckets[clave] = (tokens, ahora)
+
+
+# Listados y búsquedas: leen muchas filas, tienen su propio bucket más estricto
+RUTAS_COSTOSAS = {"/recursos", "/prestamos", "/tipos", "/recursos/duplicados"}
+# Sin límites: sondas del orquestador
+RUTAS_EXENTAS = {"/health/live", "/health/ready"}
+# Conexiones de larga duración: cuentan para el rate limit pero no ocupan
+# hueco de concurrencia (no retienen conexión de BD mientras esperan eventos)
+RUTAS_STREAMING = {"/recursos/stream"}
+
+
+class LimiteMiddleware:
+    """
+    Middleware ASGI de admisión:
+      1. Rate limit por cliente con un bucket para rutas costosas y otro para
+         el resto -> 429 + Retry-After. El cliente es la cabecera X-API-Key solo
+         si está en `api_keys`; si no (o si no hay cabecera), su IP. Así rotar
+         claves inventadas no da buckets nuevos ni llena el store.
+      2. Tope global de peticiones en curso en el worker, por debajo del pool de
+         conexiones de la BD -> 503 + Retry-After en vez de esperar al pool.
+    """
+
+    def __init__(
+        self,
+        app,
+        store: BucketStore | None = None,
+        limite_economicas: Limite = Limite(100, 50),
+        limite_costosas: Limite = Limite(20, 5),
+        max_concurrencia: int = 15,
+        api_keys: frozenset[str] = frozenset(),
+    ):
+        self.app = app
+        self.api_keys = api_keys
+        self.store = store or MemoriaBucketStore()
+        self.limite_economicas = limite_economicas
+        self.limite_costosas = limite_costosas
+        self.max_concurrencia = max_concurrencia
+        self.en_curso = 0  # solo se toca desde el event loop
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in RUTAS_EXENTAS:
+            await self.app(scope, receive, send)
+            return
+
+        cliente = self._cliente(scope)
+        costosa = scope["method"] == "GET" and scope["path"] in RUTAS_COSTOSAS
+        tipo = "costosa" if costosa else "economica"
+        espera = self.store.consumir(
+            f"{cliente}:{tipo}", self.limite_costosas if costosa else self.limite_economicas
+        )
+        if espera > 0:
+            logger.warning(f"[limites] 429 para {cliente} ({tipo}) en {scope['path']}")
+            await self._rechazar(scope, receive, send, 429, "Demasiadas peticiones", espera)
+            return
+
+        if scope["path"] in RUTAS_STREAMING:
+            await self.app(scope, receive, send)
+            return
+
+        if self.en_curso >= self.max_concurrencia:
+            logger.warning(f"[limites] 503: {self.en_curso} peticiones en curso, se rechaza {scope['path']}")
+            await self._rechazar(scope, receive, send, 503, "Servicio saturado, reintenta más tarde", 1)
+            return
+
+        self.en_curso += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.en_curso -= 1
+
+    def _cliente(self, scope) -> str:
+        for nombre, valor in scope.get("headers", []):
+            if nombre == b"x-api-key" and valor:
+                clave = valor.decode("latin-1")
+                if clave in self.api_keys:
+                    return "key:" + clave
+                break
+        client = scope.get("client")
+        return "ip:" + (client[0] if client else "desconocido")
+
+    @staticmethod
+    async def _rechazar(scope, receive, send, status_code: int, detalle: str, espera: float) -> None:
+        response = JSONResponse(
+            {"detail": detalle},
+            status_code=status_code,
+            headers={"Retry-After": str(max(1, math.ceil(espera)))},
+        )
+        await response(scope, receive, send)
@@ -1,11 +1,15 @@
+import asyncio
+import json
 import logging
+import os
+import threading
 from pathlib import Path
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import text
-from bbdd import SessionLocal, engine
-from models import DecBase
+from bbdd import SessionLocal, engine, init_db
 import models
 
 from typing import Optional
@@ -13,6 +17,8 @@ from fastapi import APIRouter, Depends, HTTPException, Body, status
 from sqlalchemy.orm import Session
 
 import crud
+import eventos
+import limites
 import schemas as schemas
 
 
@@ -20,7 +26,11 @@ import schemas as schemas
 logger = logging.getLogger("biblioteca_digital")
 logger.setLevel(logging.DEBUG)
 
-if not logger.handlers:
+
+def setup_logging() -> None:
+    """Handlers de consola y ficheros. Se llama en el arranque, no al importar."""
+    if logger.handlers:
+        return
     log_format = logging.Formatter("[%(asctime)s] %(levelname)s - %(message)s")
 
     # Consola (DEBUG+)
@@ -33,21 +43,59 @@ if not logger.handlers:
     logs_dir = Path("logs")
     logs_dir.mkdir(exist_ok=True)
 
-    # Archivo debug.log (DEBUG+)
-    debug_file = logging.FileHandler(logs_dir / "debug.log", encoding="utf-8")
+    # Archivo debug.log (DEBUG+); delay=True: el fichero se abre con el primer mensaje
+    debug_file = logging.FileHandler(logs_dir / "debug.log", encoding="utf-8", delay=True)
     debug_file.setLevel(logging.DEBUG)
     debug_file.setFormatter(log_format)
     logger.addHandler(debug_file)
 
     # Archivo warning.log (WARNING+)
-    warning_file = logging.FileHandler(logs_dir / "warning.log", encoding="utf-8")
+    warning_file = logging.FileHandler(logs_dir / "warning.log", encoding="utf-8", delay=True)
     warning_file.setLevel(logging.WARNING)
     warning_file.setFormatter(log_format)
     logger.addHandler(warning_file)
 
 
+# Modo de inicialización de la BD en el arranque:
+#   auto   -> create_all solo si PRAGMA user_version != SCHEMA_VERSION (por defecto)
+#   always -> create_all en cada arranque (comportamiento antiguo)
+#   skip   -> no toca el esquema (p.ej. lo gestiona un despliegue previo)
+DB_INIT_MODE = os.getenv("DB_INIT_MODE", "auto").lower()
+
+_db_ready = False
+# /health/ready corre en el threadpool: varias sondas a la vez no deben migrar en paralelo
+_db_lock = threading.Lock()
+
+
+def _ensure_db() -> bool:
+    """Inicializa la BD una sola vez por proceso. Devuelve si quedó lista."""
+    global _db_ready
+    if _db_ready:
+        return True
+    with _db_lock:
+        if _db_ready:
+            return True
+        try:
+            if DB_INIT_MODE != "skip":
+                init_db(engine, force=DB_INIT_MODE == "always")
+            _db_ready = True
+        except SQLAlchemyError as e:
+            logger.exception("Database initialization error: %s", e)
+    return _db_ready
+
+
 app = FastAPI(title="Biblioteca Digital API")
-logger.info("FastAPI app initialized")
+
+# Rate limit por cliente ("capacidad/por_segundo") y tope de peticiones en curso
+# por worker. El tope por defecto (15) es el pool de SQLAlchemy: 5 + 10 de overflow.
+# API_KEYS: claves (separadas por comas) con bucket propio; el resto, por IP.
+app.add_middleware(
+    limites.LimiteMiddleware,
+    limite_economicas=limites.Limite.parse(os.getenv("RATE_LIMIT_ECONOMICAS", "100/50"), "RATE_LIMIT_ECONOMICAS"),
+    limite_costosas=limites.Limite.parse(os.getenv("RATE_LIMIT_COSTOSAS", "20/5"), "RATE_LIMIT_COSTOSAS"),
+    max_concurrencia=int(os.getenv("MAX_CONCURRENCIA", "15")),
+    api_keys=frozenset(k.strip() for k in os.getenv("API_KEYS", "").split(",") if k.strip()),
+)
 
 @app.get("/")
 def root():
@@ -55,17 +103,40 @@ def root():
     
 @app.on_event("startup")
 def on_startup() -> None:
+    setup_logging()
+    logger.info("FastAPI app initialized")
+    # Sin SELECT 1 aquí: la comprobación de conexión la hace /health/ready.
+    # Nota: si falla no hacemos raise para que Uvicorn no entre en bucle;
+    # /health/ready responderá 503 y reintentará la inicialización.
+    _ensure_db()
+
+
+@app.on_event("shutdown")
+def on_shutdown() -> None:
+    # uvicorn ya ha esperado a las peticiones en curso; se cierran las conexiones del worker
+    engine.dispose()
+    logger.info("FastAPI app stopped")
+
+
+# ------------------------ ENDPOINTS: /health ------------------------
+
+# GET /health/live   (el proceso responde; no toca la BD)
+@app.get("/health/live", status_code=200, tags=["Health"])
+def health_live():
+    return {"status": "ok"}
+
+# GET /health/ready  (esquema inicializado y BD accesible)
+@app.get("/health/ready", status_code=200, tags=["Health"])
+def health_ready():
+    if not _ensure_db():
+        return JSONResponse(status_code=503, content={"status": "unavailable", "db": "no inicializada"})
     try:
-        DecBase.metadata.create_all(bind=engine)
-        logger.debug("Database tables created (if not exist)")
-        # Sondeo rápido de conexión
         with engine.connect() as conn:
             conn.execute(text("SELECT 1"))
-        logger.info("Database connection OK")
     except SQLAlchemyError as e:
-        logger.exception("Database initialization error: %s", e)
-        # Nota: no hacemos raise para que Uvicorn no entre en bucle;
-        # si quieres abortar el start, puedes relanzar la excepción.
+        logger.warning(f"[api] /health/ready: BD no accesible: {e}")
+        return JSONResponse(status_code=503, content={"status": "unavailable", "db": "sin conexión"})
+    return {"status": "ok", "db": "ok"}
 
 
 def get_db():
@@ -76,29 +147,48 @@ def get_db():
         db.close()
 
 
+# ---------------- Selección de campos (?fields=) ----------------
+def _parse_fields(fields: Optional[str], allowed: tuple[str, ...]) -> Optional[list[str]]:
+    """'id,titulo' -> ['id', 'titulo']; None/vacío -> None (todos los campos)."""
+    if not fields:
+        return None
+    pedidos = [f.strip() for f in fields.split(",") if f.strip()]
+    desconocidos = [f for f in pedidos if f not in allowed]
+    if desconocidos:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Campos no válidos: {', '.join(desconocidos)}. Permitidos: {', '.join(allowed)}",
+        )
+    # Sin duplicados y respetando el orden pedido
+    return list(dict.fromkeys(pedidos)) or None
+
+
 # ---------------- Helper de salida ----------------
-def _tipo_to_dict(tr) -> dict:
-    return {
-        "id": tr.id,
-        "nombre": tr.nombre,
-        "descripcion": tr.descripcion,
-    }
+TIPO_FIELDS = ("id", "nombre", "descripcion")
+
+def _tipo_to_dict(tr, fields: Optional[list[str]] = None) -> dict:
+    # Solo se accede a los atributos pedidos: los no cargados (load_only) no llegan a leerse
+    return {f: getattr(tr, f) for f in (fields or TIPO_FIELDS)}
 
 
 # ------------------------ ENDPOINTS: /tipos ------------------------
 
-# GET /tipos?search=
+# GET /tipos?search=&fields=
 @app.get("/tipos", status_code=200, tags=["Tipos de recurso"])
 def list_tipos_recurso(
     search: Optional[str] = None,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db),
 ):
-    logger.debug("[api] GET /tipos")
-    rows = crud.list_tipos_recurso(db)
+    logger.debug(f"[api] GET /tipos fields={fields}")
+    campos = _parse_fields(fields, TIPO_FIELDS)
+    # El filtro search necesita nombre/descripcion aunque no se devuelvan
+    columnas = list(dict.fromkeys(campos + ["nombre", "descripcion"])) if campos and search else campos
+    rows = crud.list_tipos_recurso(db, fields=columnas)
     if search:
         s = search.lower()
         rows = [r for r in rows if s in (r.nombre or "").lower() or s in (r.descripcion or "").lower()]
-    return [_tipo_to_dict(r) for r in rows]
+    return [_tipo_to_dict(r, campos) for r in rows]
 
 # POST /tipos
 @app.post("/tipos", status_code=201, tags=["Tipos de recurso"])
@@ -108,17 +198,19 @@ def create_tipo_recurso(body: schemas.TipoRecursoCreate, db: Session = Depends(g
         raise HTTPException(status_code=409, detail="El tipo de recurso ya existe")
     return {"id": tr.id, "nombre": tr.nombre, "descripcion": tr.descripcion}
 
-# GET /tipos/{tipo_id}
+# GET /tipos/{tipo_id}?fields=
 @app.get("/tipos/{tipo_id}", status_code=200, tags=["Tipos de recurso"])
 def get_tipo_recurso(
     tipo_id: int,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db),
 ):
-    logger.debug(f"[api] GET /tipos/{tipo_id}")
-    tr = crud.get_tipo_recurso(db, tipo_id)
+    logger.debug(f"[api] GET /tipos/{tipo_id} fields={fields}")
+    campos = _parse_fields(fields, TIPO_FIELDS)
+    tr = crud.get_tipo_recurso(db, tipo_id, fields=campos)
     if not tr:
         raise HTTPException(status_code=404, detail="Tipo de recurso no encontrado")
-    return _tipo_to_dict(tr)
+    return _tipo_to_dict(tr, campos)
 
 # PUT /tipos/{tipo_id}
 @app.put("/tipos/{tipo_id}", status_code=200, tags=["Tipos de recurso"])
@@ -134,33 +226,33 @@ def update_tipo_recurso(
     return _tipo_to_dict(tr)
 
 # ---------------- Helper de salida ----------------
-def _recurso_to_dict(r: models.Recurso) -> dict:
-    return {
-        "id": r.id,
-        "titulo": r.titulo,
-        "autor": r.autor,
-        "descripcion": r.descripcion,
-        "isbn": r.isbn,
-        "is_promoted": r.is_promoted,
-        "copias_totales": r.copias_totales,
-        "copias_disponibles": r.copias_disponibles,
-        "tipo_id": getattr(r, "tipo_id", None),   # si usas FK
-        # "tipo": getattr(r, "tipo", None),       # descomenta si tienes columna de texto
-    }
+RECURSO_FIELDS = (
+    "id", "titulo", "autor", "descripcion", "isbn", "is_promoted",
+    "copias_totales", "copias_disponibles",
+    "tipo_id",      # si usas FK
+    # "tipo",       # descomenta si tienes columna de texto
+)
+
+def _recurso_to_dict(r: models.Recurso, fields: Optional[list[str]] = None) -> dict:
+    return {f: getattr(r, f) for f in (fields or RECURSO_FIELDS)}
 
 # ------------------------ ENDPOINTS: /recursos ------------------------
 
-# GET /recursos?q=&tipo_id=&solo_promocionados=
+# GET /recursos?q=&tipo_id=&solo_promocionados=&fields=
 @app.get("/recursos", status_code=200, tags=["Recursos"])
 def list_recursos(
     q: Optional[str] = None,
     tipo_id: Optional[int] = None,
     solo_promocionados: bool = False,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db),
 ):
-    logger.debug(f"[api] GET /recursos q={q} tipo_id={tipo_id} promo={solo_promocionados}")
-    rows = crud.list_recursos(db, q=q, tipo_id=tipo_id, solo_promocionados=solo_promocionados)
-    return [_recurso_to_dict(r) for r in rows]
+    logger.debug(f"[api] GET /recursos q={q} tipo_id={tipo_id} promo={solo_promocionados} fields={fields}")
+    campos = _parse_fields(fields, RECURSO_FIELDS)
+    rows = crud.list_recursos(
+        db, q=q, tipo_id=tipo_id, solo_promocionados=solo_promocionados, fields=campos
+    )
+    return [_recurso_to_dict(r, campos) for r in rows]
 
 # POST /recursos
 @app.post("/recursos", status_code=status.HTTP_201_CREATED, tags=["Recursos"])
@@ -170,19 +262,97 @@ def create_recurso(
 ):
     logger.debug(f"[api] POST /recursos body={body}")
     rec = crud.create_recurso(db, body)
+    if rec is None:
+        raise HTTPException(status_code=409, detail="Ya existe un recurso con ese ISBN")
     return _recurso_to_dict(rec)
 
-# GET /recursos/{recurso_id}
+# Intervalo de comentarios keep-alive en el stream SSE (segundos)
+SSE_HEARTBEAT = 15
+
+def _parse_ids(ids: Optional[str]) -> Optional[set[int]]:
+    """'1,2,3' -> {1, 2, 3}; None/vacío -> None (todos los recursos)."""
+    if not ids:
+        return None
+    try:
+        return {int(i) for i in ids.split(",") if i.strip()} or None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids debe ser una lista de enteros separados por comas")
+
+# GET /recursos/stream?ids=   (Server-Sent Events con cambios de copias_disponibles)
+# Debe declararse antes de /recursos/{recurso_id}
+@app.get("/recursos/stream", status_code=200, tags=["Recursos"])
+async def stream_recursos(
+    request: Request,
+    ids: Optional[str] = None,
+):
+    recurso_ids = _parse_ids(ids)
+    logger.debug(f"[api] GET /recursos/stream ids={recurso_ids}")
+
+    async def event_source():
+        # La suscripción se crea dentro del generador: si el cliente se desconecta
+        # antes de empezar a iterar, no queda ninguna suscripción sin cancelar
+        sub = eventos.broker.suscribir(recurso_ids)
+        try:
+            # Primer comentario: el cliente sabe que ya está suscrito
+            yield ": conectado\n\n"
+            while True:
+                try:
+                    evento = await asyncio.wait_for(sub.cola.get(), timeout=SSE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                if evento is eventos.OVERFLOW:
+                    logger.warning("[api] Stream SSE desbordado; se cierra para que el cliente reconecte")
+                    yield "event: overflow\ndata: {}\n\n"
+                    break
+                yield f"event: disponibilidad\ndata: {json.dumps(evento)}\n\n"
+        finally:
+            eventos.broker.cancelar(sub)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# GET /recursos/duplicados?isbn=&titulo=&autor=
+# Con parámetros: candidatos a duplicado de ese ISBN/titulo+autor.
+# Sin parámetros: grupos de recursos existentes con el mismo titulo+autor normalizado.
+# autor solo se admite junto con titulo (400 si llega solo).
+@app.get("/recursos/duplicados", status_code=200, tags=["Recursos"])
+def list_duplicados(
+    isbn: Optional[str] = None,
+    titulo: Optional[str] = None,
+    autor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    logger.debug(f"[api] GET /recursos/duplicados isbn={isbn} titulo={titulo} autor={autor}")
+    if autor and not titulo:
+        # La huella es de titulo+autor: autor por sí solo no identifica candidatos
+        raise HTTPException(status_code=400, detail="autor solo se puede usar junto con titulo")
+    if not (isbn or titulo):
+        return [{"ids": ids} for ids in crud.grupos_duplicados(db)]
+    try:
+        rows = crud.buscar_duplicados(db, isbn=isbn, titulo=titulo, autor=autor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return [_recurso_to_dict(r) for r in rows]
+
+# GET /recursos/{recurso_id}?fields=
 @app.get("/recursos/{recurso_id}", status_code=200, tags=["Recursos"])
 def get_recurso(
     recurso_id: int,
+    fields: Optional[str] = None,
     db: Session = Depends(get_db),
 ):
-    logger.debug(f"[api] GET /recursos/{recurso_id}")
-    rec = crud.get_recurso(db, recurso_id)
+    logger.debug(f"[api] GET /recursos/{recurso_id} fields={fields}")
+    campos = _parse_fields(fields, RECURSO_FIELDS)
+    rec = crud.get_recurso(db, recurso_id, fields=campos)
     if not rec:
         raise HTTPException(status_code=404, detail="Recurso no encontrado")
-    return _recurso_to_dict(rec)
+    return _recurso_to_dict(rec, campos)
 
 # PUT /recursos/{recurso_id}
 @app.put("/recursos/{recurso_id}", status_code=200, tags=["Recursos"])
@@ -201,28 +371,33 @@ def update_recurso(
 
 
 # ---------------- Helper de salida ----------------
-def _prestamo_to_dict(p: models.Prestamo) -> dict:
-    return {
-        "id": p.id,
-        "recurso_id": p.recurso_id,
-        "usuario": p.usuario,
-        "fecha_prestamo": p.fecha_prestamo,
-        "fecha_vencimiento": p.fecha_vencimiento,
-        "devuelto": p.devuelto,
-    }
+PRESTAMO_FIELDS = (
+    "id", "recurso_id", "usuario", "fecha_prestamo", "fecha_vencimiento", "devuelto", "fecha_devolucion",
+)
+
+def _prestamo_to_dict(p: models.Prestamo | models.PrestamoHistorico, fields: Optional[list[str]] = None) -> dict:
+    return {f: getattr(p, f) for f in (fields or PRESTAMO_FIELDS)}
 
 # ---------------------- ENDPOINTS: /prestamos ----------------------
 
-# GET /prestamos?usuario=&solo_activos=
+# GET /prestamos?usuario=&solo_activos=&fields=&incluir_historico=
 @app.get("/prestamos", status_code=200, tags=["Préstamos"])
 def list_prestamos(
     usuario: Optional[str] = None,
     solo_activos: bool = False,
+    fields: Optional[str] = None,
+    incluir_historico: bool = False,
     db: Session = Depends(get_db),
 ):
-    logger.debug(f"[api] GET /prestamos usuario={usuario} solo_activos={solo_activos}")
-    rows = crud.list_prestamos(db, usuario=usuario, solo_activos=solo_activos)
-    return [_prestamo_to_dict(p) for p in rows]
+    logger.debug(
+        f"[api] GET /prestamos usuario={usuario} solo_activos={solo_activos} "
+        f"fields={fields} historico={incluir_historico}"
+    )
+    campos = _parse_fields(fields, PRESTAMO_FIELDS)
+    rows = crud.list_prestamos(
+        db, usuario=usuario, solo_activos=solo_activos, fields=campos, incluir_historico=incluir_historico
+    )
+    return [_prestamo_to_dict(p, campos) for p in rows]
 
 # POST /prestamos
 @app.post("/prestamos", status_code=status.HTTP_201_CREATED, tags=["Préstamos"])
@@ -237,17 +412,20 @@ def create_prestamo(
         raise HTTPException(status_code=409, detail="No se pudo crear el préstamo (recurso inexistente o sin copias)")
     return _prestamo_to_dict(p)
 
-# GET /prestamos/{prestamo_id}
+# GET /prestamos/{prestamo_id}?fields=&incluir_historico=
 @app.get("/prestamos/{prestamo_id}", status_code=200, tags=["Préstamos"])
 def get_prestamo(
     prestamo_id: int,
+    fields: Optional[str] = None,
+    incluir_historico: bool = False,
     db: Session = Depends(get_db),
 ):
-    logger.debug(f"[api] GET /prestamos/{prestamo_id}")
-    p = crud.get_prestamo(db, prestamo_id)
+    logger.debug(f"[api] GET /prestamos/{prestamo_id} fields={fields} historico={incluir_historico}")
+    campos = _parse_fields(fields, PRESTAMO_FIELDS)
+    p = crud.get_prestamo(db, prestamo_id, fields=campos, incluir_historico=incluir_historico)
     if not p:
         raise HTTPException(status_code=404, detail="Préstamo no encontrado")
-    return _prestamo_to_dict(p)
+    return _prestamo_to_dict(p, campos)
 
 # PUT /prestamos/{prestamo_id}/devolucion
 @app.put("/prestamos/{prestamo_id}/devolucion", status_code=200, tags=["Préstamos"])
@@ -1,5 +1,5 @@
 from sqlalchemy.orm import DeclarativeBase, relationship
-from sqlalchemy import Integer, String, Text, Column, ForeignKey, Boolean, DateTime
+from sqlalchemy import Integer, String, Text, Column, ForeignKey, Boolean, DateTime, Index
 from datetime import datetime, timezone
 
 
@@ -24,6 +24,10 @@ class Recurso(DecBase):
     autor = Column(String(100), nullable=True)
     descripcion = Column(Text, default="")
     isbn = Column(String(20), nullable=True)
+    # ISBN-13 normalizado (normalizacion.normalizar_isbn): único, detecta el mismo libro en ISBN-10/13
+    isbn_normalizado = Column(String(13), unique=True, index=True, nullable=True)
+    # sha1 de titulo+autor normalizados (normalizacion.huella_titulo_autor) para buscar duplicados
+    huella_titulo_autor = Column(String(40), index=True, nullable=True)
     copias_totales = Column(Integer, default=1)
     copias_disponibles = Column(Integer, default=1)
     is_promoted = Column(Boolean, default=False) # revisar si quiero tenerlo, puede ser interesante para tarea asincrona
@@ -43,9 +47,30 @@ class Prestamo(DecBase):
     fecha_prestamo = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     fecha_vencimiento = Column(DateTime(timezone=True), nullable=False)
     devuelto = Column(Boolean, default=False)
+    # Se rellena al devolver; los préstamos antiguos (anteriores a v4) la tienen a NULL
+    fecha_devolucion = Column(DateTime(timezone=True), nullable=True)
 
     # Clave foránea a recurso
-    recurso_id = Column(Integer, ForeignKey("recursos.id"), nullable=False)
+    recurso_id = Column(Integer, ForeignKey("recursos.id"), nullable=False, index=True)
     recurso = relationship("Recurso", back_populates="prestamos")
 
+    # Préstamos activos y selección de lotes a archivar (devuelto + antigüedad)
+    __table_args__ = (
+        Index("ix_prestamos_devuelto_fecha", "devuelto", "fecha_prestamo"),
+        Index("ix_prestamos_devuelto_fecha_devolucion", "devuelto", "fecha_devolucion"),
+    )
+
+class PrestamoHistorico(DecBase):
+    # Préstamos devueltos antiguos movidos por crud.archivar_prestamos (conservan su id)
+    __tablename__ = "prestamos_historico"
+
+    id = Column(Integer, primary_key=True)
+    usuario = Column(String(120), nullable=False, index=True)
+    fecha_prestamo = Column(DateTime(timezone=True))
+    fecha_vencimiento = Column(DateTime(timezone=True), nullable=False)
+    devuelto = Column(Boolean, default=True)
+    fecha_devolucion = Column(DateTime(timezone=True), nullable=True)
+    recurso_id = Column(Integer, nullable=False, index=True)
+    archivado_en = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
     
\ No newline at end of file
@@ -0,0 +1,48 @@
+import hashlib
+import re
+import unicodedata
+from typing import Optional
+
+
+def normalizar_isbn(valor) -> str:
+    """
+    Valida un ISBN-10 o ISBN-13 (con o sin guiones/espacios) y lo devuelve
+    como ISBN-13 sin separadores, para que ambas formas del mismo libro coincidan.
+    Lanza ValueError si el formato o el dígito de control no son válidos.
+    """
+    s = re.sub(r"[\s-]", "", str(valor)).upper()
+
+    if re.fullmatch(r"\d{9}[\dX]", s):
+        total = sum((10 - i) * int(c) for i, c in enumerate(s[:9]))
+        total += 10 if s[9] == "X" else int(s[9])
+        if total % 11 != 0:
+            raise ValueError("ISBN-10 con dígito de control incorrecto")
+        base = "978" + s[:9]
+        return base + _control_isbn13(base)
+
+    if re.fullmatch(r"\d{13}", s):
+        if not s.startswith(("978", "979")):
+            raise ValueError("ISBN-13 debe empezar por 978 o 979")
+        if _control_isbn13(s[:12]) != s[12]:
+            raise ValueError("ISBN-13 con dígito de control incorrecto")
+        return s
+
+    raise ValueError("ISBN debe tener 10 o 13 dígitos (el ISBN-10 puede acabar en X)")
+
+
+def _control_isbn13(doce: str) -> str:
+    total = sum(int(c) * (1 if i % 2 == 0 else 3) for i, c in enumerate(doce))
+    return str((10 - total % 10) % 10)
+
+
+def _normalizar_texto(s: Optional[str]) -> str:
+    # Sin tildes, en minúsculas y solo letras/números separados por un espacio
+    s = unicodedata.normalize("NFKD", s or "")
+    s = "".join(c for c in s if not unicodedata.combining(c)).lower()
+    return re.sub(r"[^a-z0-9]+", " ", s).strip()
+
+
+def huella_titulo_autor(titulo: Optional[str], autor: Optional[str]) -> str:
+    """Huella (sha1 hex) de titulo+autor normalizados: 'Cálculo  I' / 'LARSON' == 'calculo i' / 'larson'."""
+    clave = f"{_normalizar_texto(titulo)}|{_normalizar_texto(autor)}"
+    return hashlib.sha1(clave.encode("utf-8")).hexdigest()
@@ -3,6 +3,7 @@ from enum import Enum
 from typing import Optional
 from pydantic import BaseModel, Field, EmailStr, constr, conint, field_validator, model_validator
 
+from normalizacion import normalizar_isbn
 
 
 class TipoRecursoCreate(BaseModel):
@@ -37,6 +38,14 @@ class RecursoCreate(BaseModel):
                 raise ValueError(f"Tipo de recurso '{v}' no existe")
         return v
     
+    @field_validator("isbn")
+    @classmethod
+    def validar_isbn(cls, v: Optional[str]):
+        if v is None:
+            return v
+        normalizar_isbn(v)  # ValueError si el ISBN no es válido
+        return v.strip()
+
     @field_validator("copias_disponibles")
     @classmethod
     def validar_disponibles_vs_totales(cls, v: Optional[int], info):
@@ -61,6 +70,14 @@ class RecursoUpdate(BaseModel):
     is_promoted: Optional[bool] = None
     tipo_id: Optional[int] = None
 
+    @field_validator("isbn")
+    @classmethod
+    def validar_isbn_update(cls, v: Optional[str]):
+        if v is None:
+            return v
+        normalizar_isbn(v)
+        return v.strip()
+
     @field_validator("tipo")
     @classmethod
     def validar_tipo_existente_update(cls, v: Optional[str]):
@@ -0,0 +1,204 @@
+# serve.py
+# Punto de entrada para producción: varios workers de uvicorn, uno por núcleo.
+#
+#   python serve.py --workers 4 --backlog 2048 --keep-alive 5
+#   python serve.py --preload          # importa main una vez y hace fork (solo POSIX)
+#
+# Cada worker es un proceso independiente (shared-nothing) con su propio pool de
+# conexiones: en modo preload bbdd.py descarta el pool heredado tras el fork.
+# Con SIGTERM/SIGINT los workers dejan de aceptar conexiones y terminan las
+# peticiones en curso (p.ej. un préstamo a medio crear) antes de salir.
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+import uvicorn
+
+logger = logging.getLogger("biblioteca_digital")
+
+# Un worker que muere antes de este tiempo cuenta como fallo de arranque;
+# tras MAX_FALLOS_ARRANQUE seguidos se deja de relanzar y se para el servidor
+ARRANQUE_MINIMO = 5.0
+MAX_FALLOS_ARRANQUE = 5
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Servidor multiproceso de la API Biblioteca Digital")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="número de procesos (por defecto, uno por núcleo)")
+    parser.add_argument("--backlog", type=int, default=2048,
+                        help="cola de conexiones pendientes del socket")
+    parser.add_argument("--keep-alive", type=int, default=5,
+                        help="segundos que se mantiene abierta una conexión inactiva")
+    parser.add_argument("--graceful-timeout", type=int, default=30,
+                        help="segundos para terminar las peticiones en curso al parar")
+    parser.add_argument("--preload", action="store_true",
+                        help="importa la app en el proceso padre y hace fork de los workers")
+    return parser.parse_args(argv)
+
+
+def _uvicorn_config(app, args: argparse.Namespace) -> uvicorn.Config:
+    return uvicorn.Config(
+        app,
+        host=args.host,
+        port=args.port,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        lifespan="on",
+    )
+
+
+def _bind_socket(args: argparse.Namespace) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(app, args: argparse.Namespace, sock: socket.socket) -> None:
+    # Hijo recién creado: sin los manejadores de señales del padre,
+    # uvicorn instala los suyos (parada ordenada con SIGTERM/SIGINT).
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server = uvicorn.Server(_uvicorn_config(app, args))
+    server.run(sockets=[sock])
+
+
+def serve_preload(args: argparse.Namespace) -> None:
+    if not hasattr(os, "fork"):
+        sys.exit("--preload necesita os.fork (Linux/macOS)")
+
+    import main  # una sola importación, compartida por copy-on-write
+
+    main.setup_logging()
+    # El esquema se inicializa una vez aquí y no en cada worker a la vez
+    main._ensure_db()
+    main.engine.dispose()
+
+    sock = _bind_socket(args)
+    workers: dict[int, tuple[int, float]] = {}  # pid -> (nº de worker, instante de arranque)
+    fallos: dict[int, int] = {}  # nº de worker -> fallos de arranque seguidos
+    stopping = False
+    abortado = False
+    # stop() la activa para cortar la espera entre relanzamientos
+    despertar = threading.Event()
+
+    def spawn(n: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            codigo = 0
+            try:
+                _run_worker(main.app, args, sock)
+            except BaseException:
+                logger.exception(f"[serve] Worker {n} (pid {os.getpid()}) terminó con una excepción")
+                codigo = 1
+            finally:
+                os._exit(codigo)
+        workers[pid] = (n, time.monotonic())
+        logger.info(f"[serve] Worker {n} arrancado (pid {pid})")
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping
+        if stopping:
+            # Segunda señal: parada inmediata
+            for pid in workers:
+                os.kill(pid, signal.SIGKILL)
+            return
+        stopping = True
+        despertar.set()
+        logger.info(f"[serve] Señal {signum}: parando {len(workers)} workers")
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for n in range(args.workers):
+        spawn(n)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        info = workers.pop(pid, None)
+        if info is None or stopping:
+            continue
+        n, inicio = info
+        codigo = os.waitstatus_to_exitcode(status)
+        if time.monotonic() - inicio < ARRANQUE_MINIMO:
+            fallos[n] = fallos.get(n, 0) + 1
+        else:
+            fallos[n] = 0
+        if fallos[n] >= MAX_FALLOS_ARRANQUE:
+            logger.error(
+                f"[serve] Worker {n} ha fallado {fallos[n]} veces seguidas al arrancar "
+                f"(último código {codigo}); se para el servidor"
+            )
+            abortado = True
+            stop(signal.SIGTERM, None)
+            continue
+        # Espera exponencial entre relanzamientos si falla al arrancar (0.5 s, 1 s, 2 s...)
+        espera = 0.5 * 2 ** max(fallos[n] - 1, 0)
+        logger.warning(f"[serve] Worker {n} (pid {pid}) terminó con código {codigo}; se relanza en {espera:.1f} s")
+        despertar.wait(espera)
+        if stopping:
+            # Señal durante la espera: no se crea un worker que nadie pararía
+            continue
+        spawn(n)
+
+    sock.close()
+    logger.info("[serve] Todos los workers han terminado")
+    if abortado:
+        sys.exit(1)
+
+
+def _init_db_antes_de_workers() -> None:
+    # El esquema se inicializa una vez en el padre, respetando DB_INIT_MODE; así
+    # los workers encuentran user_version al día y no migran todos a la vez
+    import bbdd
+
+    modo = os.getenv("DB_INIT_MODE", "auto").lower()
+    if modo == "skip":
+        return
+    bbdd.init_db(force=modo == "always")
+    bbdd.engine.dispose()
+    # Con "always" los workers volverían a forzar create_all en paralelo
+    os.environ["DB_INIT_MODE"] = "auto"
+
+
+def serve(args: argparse.Namespace) -> None:
+    # Sin preload: uvicorn lanza los workers como procesos nuevos (spawn);
+    # cada uno importa main y crea su propio engine.
+    _init_db_antes_de_workers()
+    uvicorn.run(
+        "main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+    )
+
+
+def run(argv=None) -> None:
+    args = parse_args(argv)
+    if args.preload:
+        serve_preload(args)
+    else:
+        serve(args)
+
+
+if __name__ == "__main__":
+    run()